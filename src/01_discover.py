@@ -12,9 +12,9 @@ from __future__ import annotations
 
 import argparse, json
 from pathlib import Path
-from pystac_client import Client
 from utils.cfg import load_config
 from utils.log import get_logger
+from utils.stac_utils import open_catalog, save_items
 
 def parse_bbox(bbox_str: str):
     parts = [float(x) for x in bbox_str.split(",")]
@@ -38,7 +38,7 @@ def main():
 
     stac_url = cfg["stac"]["url"]
     log.info(f"Connecting to STAC: {stac_url}")
-    catalog = Client.open(stac_url)
+    catalog = open_catalog(stac_url)
 
     search = catalog.search(bbox=bbox, datetime=date, collections=["sentinel-2-l2a"])  # S2 L2A on Planetary Computer
     items = list(search.get_items())
@@ -52,7 +52,8 @@ def main():
             "id": it.id,
             "datetime": it.datetime.isoformat() if it.datetime else None,
             "cloud_cover": cc,
-            "assets": list(it.assets.keys())
+            "assets": list(it.assets.keys()),
+            "hrefs": {k: a.href for k, a in it.assets.items()},
         })
 
     # Filter by cloud cover if present
@@ -71,6 +72,11 @@ def main():
     Path("data/raw").mkdir(parents=True, exist_ok=True)
     Path("data/raw/discover.json").write_text(json.dumps(out, indent=2))
     log.info("Wrote data/raw/discover.json")
+
+    # Full items for step 02 / 03 so they don't have to search again
+    kept = {r["id"] for r in out["items"]}
+    save_items([it for it in items if it.id in kept])
+    log.info("Wrote data/raw/items.pkl")
     for r in filtered[:10]:
         log.info(f"- {r['id']} | {r['datetime']} | cloud={r['cloud_cover']} | assets~{r['assets'][:5]}")
 
@@ -8,24 +8,29 @@ Usage:
 """
 from __future__ import annotations
 
-import argparse, json, sys
+import argparse, json, shutil, sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import planetary_computer
 import requests
-from pystac_client import Client
 from utils.cfg import load_config
 from utils.log import get_logger
+from utils.stac_utils import resolve_item_hrefs
 
 def fetch(url: str, out_path: Path, timeout: int, log):
     log.info(f"GET {url}")
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_bytes(r.content)
+    # Stream to disk in 1 MB chunks instead of holding the whole TIFF in RAM
+    with requests.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        with open(out_path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1 << 20)
     log.info(f"Wrote {out_path} ({out_path.stat().st_size/1e6:.2f} MB)")
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--item-id", required=True, help="STAC item id to download from (must be in the catalog)")
+    ap.add_argument("--item-id", required=True, help="STAC item id to download from (see data/raw/discover.json)")
     ap.add_argument("--red-asset", default="B04", help="Asset key for red band")
     ap.add_argument("--nir-asset", default="B08", help="Asset key for NIR band")
     ap.add_argument("--out-dir", default="data/raw", help="Directory to save bands")
@@ -35,36 +40,33 @@ def main():
     cfg = load_config()
     log = get_logger("download")
 
-    catalog = Client.open(cfg["stac"]["url"])
-    search = catalog.search(bbox=cfg["aoi"]["bbox"], datetime=cfg["aoi"]["date"], collections=["sentinel-2-l2a"])
-    candidates = list(search.get_items())
-
-    item = None
-    for it in candidates:
-        if it.id == args.item_id:
-            item = it
-            break
-    if item is None:
-        log.error("Item id not found in current search scope. Try adjusting bbox/date or verify the id from discover.json")
+    # Resolve the item from step 01's cached results; only hit STAC if it isn't there
+    stac_url = cfg["stac"]["url"]
+    resolved = resolve_item_hrefs(stac_url, args.item_id)
+    if resolved is None:
+        log.error("Item id not found in the catalog. Verify the id from discover.json")
         sys.exit(1)
+    item_datetime, hrefs = resolved
 
     # Resolve asset hrefs
-    assets = item.assets
     for key in (args.red_asset, args.nir_asset):
-        if key not in assets:
-            log.error(f"Asset {key} not found. Available: {list(assets.keys())[:10]}")
+        if key not in hrefs:
+            log.error(f"Asset {key} not found. Available: {list(hrefs.keys())[:10]}")
             sys.exit(2)
 
-    red_href = assets[args.red_asset].href
-    nir_href = assets[args.nir_asset].href
+    # Cached hrefs may be stale-signed or unsigned; sign fresh before fetching
+    red_href = planetary_computer.sign(hrefs[args.red_asset])
+    nir_href = planetary_computer.sign(hrefs[args.nir_asset])
 
     out_dir = Path(args.out_dir)
-    fetch(red_href, out_dir/"red.tif", args.timeout, log)
-    fetch(nir_href, out_dir/"nir.tif", args.timeout, log)
+    # Fetch both bands concurrently: wall-clock is the slower band, not the sum
+    jobs = [(red_href, out_dir/"red.tif"), (nir_href, out_dir/"nir.tif")]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        list(pool.map(lambda job: fetch(job[0], job[1], args.timeout, log), jobs))
 
     manifest = {
-        "item_id": item.id,
-        "datetime": item.datetime.isoformat() if item.datetime else None,
+        "item_id": args.item_id,
+        "datetime": item_datetime,
         "red_asset": args.red_asset,
         "nir_asset": args.nir_asset,
         "red_path": str((out_dir/"red.tif").as_posix()),
@@ -4,44 +4,180 @@ EPIC 2 — NDVI Computation
 
 Usage:
   python src/03_ndvi.py
+  # Read red/NIR COGs straight from the STAC item (no 02_download step),
+  # processing only the AOI window:
+  python src/03_ndvi.py --item-id <STAC_ITEM_ID> --aoi "19.80,50.00,20.20,50.30"
 """
 
+import argparse
+import os
+import sys
 from pathlib import Path
+import numexpr as ne
 import numpy as np
+import planetary_computer
 import rasterio
+from rasterio.errors import WindowError
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
 from utils.log import get_logger
+from utils.raster_utils import snapped_window
+
+# GDAL settings for reading remote COGs with HTTP range requests, plus a
+# larger block cache (MB) so decoded source tiles stay hot between windows
+COG_ENV = dict(
+    GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+    CPL_VSIL_CURL_ALLOWED_EXTENSIONS=".tif",
+    VSI_CACHE=True,
+    GDAL_HTTP_MULTIPLEX=True,
+    GDAL_NUM_THREADS="ALL_CPUS",
+    GDAL_CACHEMAX=512,
+)
+
+# NDVI is stored as int16 scaled by 10000 (standard S2 convention): half the
+# bytes of float32 on disk, in S3 and in every downstream read
+NDVI_SCALE = 10000
+NDVI_NODATA = -32768
+
+def is_remote(src: str) -> bool:
+    return src.startswith(("http://", "https://", "/vsicurl/", "s3://"))
+
+def item_band_hrefs(item_id: str, red_asset: str, nir_asset: str, log):
+    """
+    Signed red/NIR hrefs for a STAC item, from step 01's cache when possible.
+    """
+    from utils.cfg import load_config
+    from utils.stac_utils import resolve_item_hrefs
+
+    stac_url = load_config()["stac"]["url"]
+    resolved = resolve_item_hrefs(stac_url, item_id)
+    if resolved is None:
+        log.error(f"Item {item_id} not found in the catalog.")
+        sys.exit(1)
+    _, hrefs = resolved
+
+    for key in (red_asset, nir_asset):
+        if key not in hrefs:
+            log.error(f"Asset {key} not found. Available: {list(hrefs.keys())[:10]}")
+            sys.exit(2)
+    return planetary_computer.sign(hrefs[red_asset]), planetary_computer.sign(hrefs[nir_asset])
+
+def aoi_window(ds, aoi: list) -> Window:
+    """Pixel-snapped window covering an EPSG:4326 bbox, clipped to the raster."""
+    return snapped_window(ds, transform_bounds("EPSG:4326", ds.crs, *aoi))
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--red", default="data/raw/red.tif", help="Red band path or COG URL")
+    ap.add_argument("--nir", default="data/raw/nir.tif", help="NIR band path or COG URL")
+    ap.add_argument("--item-id", default=None, help="Read red/NIR COGs directly from this STAC item")
+    ap.add_argument("--red-asset", default="B04", help="Asset key for red band (with --item-id)")
+    ap.add_argument("--nir-asset", default="B08", help="Asset key for NIR band (with --item-id)")
+    ap.add_argument("--aoi", default=None, help="minx,miny,maxx,maxy (EPSG:4326); only this window is read")
+    ap.add_argument("--out", default="data/processed/ndvi.tif")
+    args = ap.parse_args()
+
     log = get_logger("ndvi")
 
-    red_path = Path("data/raw/red.tif")
-    nir_path = Path("data/raw/nir.tif")
-    out_path = Path("data/processed/ndvi.tif")
+    out_path = Path(args.out)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    if not red_path.exists() or not nir_path.exists():
-        log.error("Missing input files red.tif or nir.tif — run Epic 1 first.")
-        return
+    if args.item_id:
+        red_src, nir_src = item_band_hrefs(args.item_id, args.red_asset, args.nir_asset, log)
+    else:
+        red_src, nir_src = args.red, args.nir
+        missing = [p for p in (red_src, nir_src) if not is_remote(p) and not Path(p).exists()]
+        if missing:
+            log.error(f"Missing input files {missing} — run Epic 1 first or pass --item-id.")
+            return
 
-    # Read both bands
-    with rasterio.open(red_path) as red_ds, rasterio.open(nir_path) as nir_ds:
-        red = red_ds.read(1).astype("float32")
-        nir = nir_ds.read(1).astype("float32")
+    aoi = None
+    if args.aoi:
+        aoi = [float(x) for x in args.aoi.split(",")]
+        if len(aoi) != 4:
+            raise ValueError("aoi must be 'minx,miny,maxx,maxy'")
 
-        # Basic NDVI formula
-        ndvi = (nir - red) / (nir + red + 1e-6)
+    # numexpr caps its pool at NUMEXPR_MAX_THREADS (64 by default) and refuses more
+    ne.set_num_threads(min(os.cpu_count() or 1, ne.MAX_THREADS))
 
-        # Copy metadata from red band
+    # Stream both bands block by block instead of holding full tiles in RAM;
+    # for remote COGs only the blocks overlapping the AOI cross the network
+    with rasterio.Env(**COG_ENV), rasterio.open(red_src) as red_ds, rasterio.open(nir_src) as nir_ds:
+        try:
+            src_win = aoi_window(red_ds, aoi) if aoi else Window(0, 0, red_ds.width, red_ds.height)
+        except WindowError:
+            log.error(f"AOI {aoi} does not overlap the input raster.")
+            return
+        log.info(f"Processing window {src_win} of {red_ds.width}x{red_ds.height}")
+
+        # Copy metadata from red band, tiled so blocks stay cache-sized
         profile = red_ds.profile
-        profile.update(dtype="float32", count=1)
+        profile.update(
+            driver="GTiff", dtype="int16", count=1, nodata=NDVI_NODATA,
+            width=int(src_win.width), height=int(src_win.height),
+            transform=red_ds.window_transform(src_win),
+            tiled=True, blockxsize=512, blockysize=512,
+            compress="zstd", predictor=2, num_threads="ALL_CPUS",
+        )
 
+        ndvi_min, ndvi_max = np.inf, -np.inf
         with rasterio.open(out_path, "w", **profile) as dst:
-            dst.write(ndvi, 1)
+            # Let GDAL (and 04_zonal_stats) unscale back to real NDVI values
+            dst.scales = (1.0 / NDVI_SCALE,)
+            dst.offsets = (0.0,)
+
+            # Buffers reused across blocks (one set per block shape; only edge
+            # blocks differ): float32 red/nir/ndvi, bool masks and the int16
+            # output. GDAL converts uint16 -> float32 while reading, and every
+            # step below writes into these with out=, so the steady state
+            # allocates no per-block arrays.
+            buffers = {}
+
+            # Iterate the output's own blocks so every write is tile-aligned
+            for _, win in dst.block_windows(1):
+                read_win = Window(win.col_off + src_win.col_off, win.row_off + src_win.row_off, win.width, win.height)
+                shape = (int(win.height), int(win.width))
+                if shape not in buffers:
+                    buffers[shape] = (
+                        np.empty(shape, dtype=np.float32),
+                        np.empty(shape, dtype=np.float32),
+                        np.empty(shape, dtype=np.float32),
+                        np.empty(shape, dtype=bool),
+                        np.empty(shape, dtype=bool),
+                        np.empty(shape, dtype=np.int16),
+                    )
+                red, nir, ndvi, valid, mask, scaled = buffers[shape]
+                red_ds.read(1, window=read_win, out=red)
+                nir_ds.read(1, window=read_win, out=nir)
+
+                # Basic NDVI formula, evaluated in one blocked, multithreaded pass
+                ne.evaluate("(nir - red) / (nir + red + 1e-6)", out=ndvi, casting="same_kind")
+
+                # Source nodata (S2: red = nir = 0) would otherwise become a valid NDVI of 0
+                np.isfinite(ndvi, out=valid)
+                if red_ds.nodata is not None:
+                    np.not_equal(red, red_ds.nodata, out=mask)
+                    np.logical_and(valid, mask, out=valid)
+                if nir_ds.nodata is not None:
+                    np.not_equal(nir, nir_ds.nodata, out=mask)
+                    np.logical_and(valid, mask, out=valid)
+
+                # Running min/max instead of a full-array reduction at the end
+                ndvi_min = min(ndvi_min, float(np.min(ndvi, initial=np.inf, where=valid)))
+                ndvi_max = max(ndvi_max, float(np.max(ndvi, initial=-np.inf, where=valid)))
+
+                # Quantize to int16 in place; nodata and non-finite pixels become NDVI_NODATA
+                np.multiply(ndvi, NDVI_SCALE, out=ndvi)
+                np.rint(ndvi, out=ndvi)
+                np.clip(ndvi, -NDVI_SCALE, NDVI_SCALE, out=ndvi)
+                scaled.fill(NDVI_NODATA)
+                np.copyto(scaled, ndvi, casting="unsafe", where=valid)
+                dst.write(scaled, 1, window=win)
 
     log.info(f"✅ NDVI written to {out_path}")
 
     # Optional: show summary stats
-    log.info(f"NDVI range: min={float(np.nanmin(ndvi)):.3f}, max={float(np.nanmax(ndvi)):.3f}")
+    log.info(f"NDVI range: min={ndvi_min:.3f}, max={ndvi_max:.3f}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -11,58 +11,278 @@ Usage:
 from __future__ import annotations
 from pathlib import Path
 import argparse
+import hashlib
+import pickle
 import numpy as np
 import geopandas as gpd
+import pandas as pd
 import rasterio
-from rasterio.mask import mask
+from joblib import Parallel, delayed, effective_n_jobs
+import numba
+from numba import njit, prange
+import pyarrow as pa
+import shapely
+from pyarrow import csv as pa_csv
+from rasterio import features
+from rasterio.errors import WindowError
+from shapely import wkb
 from shapely.geometry import mapping
 from utils.log import get_logger  # 👈 Make sure you have this in src/utils/log.py
+from utils.raster_utils import snapped_window
 
-def compute_zonal_mean(raster_path: Path, vector_path: Path) -> gpd.GeoDataFrame:
+ZONAL_METHODS = ("rasterize", "windowed", "exactextract")
+
+@njit(parallel=True, cache=True)
+def reduce_zones(labels, vals, n_zones, n_chunks):
+    """
+    One sweep over flat label/value arrays, accumulating sum/count/min/max
+    per zone (zone 0 = background). Each prange chunk owns a private row of
+    accumulators; rows are combined by the caller. No fastmath: it would
+    let LLVM drop the isfinite() check that skips nodata pixels.
+    """
+    n = labels.size
+    step = (n + n_chunks - 1) // n_chunks
+    sums = np.zeros((n_chunks, n_zones), np.float64)
+    counts = np.zeros((n_chunks, n_zones), np.int64)
+    mins = np.full((n_chunks, n_zones), np.inf)
+    maxs = np.full((n_chunks, n_zones), -np.inf)
+    for t in prange(n_chunks):
+        for i in range(t * step, min(n, (t + 1) * step)):
+            z = labels[i]
+            v = vals[i]
+            if z == 0 or not np.isfinite(v):
+                continue
+            sums[t, z] += v
+            counts[t, z] += 1
+            if v < mins[t, z]:
+                mins[t, z] = v
+            if v > maxs[t, z]:
+                maxs[t, z] = v
+    return sums, counts, mins, maxs
+
+def _zone_index(src, gdf: gpd.GeoDataFrame, cache_dir: Path | None, log):
+    """
+    Flat pixel indices covered by any polygon and the zone id (row + 1) of
+    each, i.e. the rasterized label grid with background dropped. Cached
+    as data/processed/zonal_index_<hash>.pkl keyed by raster grid
+    (shape, transform, CRS) and polygon geometries, so daily runs over a
+    fixed field set skip rasterization entirely.
+    """
+    key = hashlib.sha1()
+    key.update(repr((src.shape, tuple(src.transform), src.crs.to_wkt() if src.crs else None)).encode())
+    for geom in gdf.geometry:
+        key.update(geom.wkb if geom is not None else b"")
+    cache_path = Path(cache_dir) / f"zonal_index_{key.hexdigest()[:16]}.pkl" if cache_dir else None
+
+    if cache_path is not None and cache_path.exists():
+        log.info(f"Reusing zone index: {cache_path}")
+        return pickle.loads(cache_path.read_bytes())
+
+    shapes = ((geom, i + 1) for i, geom in enumerate(gdf.geometry) if geom is not None and not geom.is_empty)
+    labels = features.rasterize(shapes, out_shape=src.shape, transform=src.transform, fill=0, dtype="int32")
+    flat = labels.ravel()
+    pix = np.flatnonzero(flat)
+    index = (pix, flat[pix])
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_bytes(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+        log.info(f"Saved zone index: {cache_path}")
+    return index
+
+def _has_overlaps(gdf: gpd.GeoDataFrame) -> bool:
+    """True if any two polygons share interior area (touching edges don't count)."""
+    left, right = gdf.sindex.query(gdf.geometry, predicate="intersects")
+    pairs = left < right
+    if not pairs.any():
+        return False
+    geoms = np.asarray(gdf.geometry.values)
+    return bool((~shapely.touches(geoms[left[pairs]], geoms[right[pairs]])).any())
+
+def _zonal_rasterize(src, gdf: gpd.GeoDataFrame, log, index_cache_dir: Path | None = None):
+    """
+    Burn all polygons into one zone-id label grid (0 = outside any field)
+    and reduce NDVI per zone in a single parallel pass over the covered
+    pixels. The band is read and decompressed exactly once. A label grid
+    holds one zone per pixel, so overlapping polygons would lose shared
+    pixels to the last one burned; compute_zonal_mean falls back to
+    'windowed' for those.
+    """
+    n = len(gdf)
+    pix, zones = _zone_index(src, gdf, index_cache_dir, log)
+    arr = src.read(1, masked=True).astype("float32").filled(np.nan)  # nodata -> NaN once
+    vals = arr.ravel()[pix]
+
+    sums, counts, mins, maxs = reduce_zones(zones, vals, n + 1, numba.get_num_threads())
+    sums = sums.sum(axis=0)[1:]
+    counts = counts.sum(axis=0)[1:]
+    mins = mins.min(axis=0)[1:]
+    maxs = maxs.max(axis=0)[1:]
+
+    empty = counts == 0
+    if empty.any():
+        log.warning(f"{int(empty.sum())} polygon(s) cover no valid pixels")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(empty, np.nan, sums / counts)
+    mins[empty] = np.nan
+    maxs[empty] = np.nan
+    return means, mins, maxs, counts
+
+def _feature_stats(src, geom, nodata):
+    """
+    Mean/min/max/count for one feature, reading only the window of each
+    sub-polygon so a sparse MultiPolygon never materialises its full bbox.
+    """
+    total, count = 0.0, 0
+    lo, hi = np.inf, -np.inf
+    if geom is None or geom.is_empty:
+        parts = []
+    elif geom.geom_type.startswith("Multi"):
+        parts = list(geom.geoms)
+    else:
+        parts = [geom]
+
+    for part in parts:
+        try:
+            win = snapped_window(src, part.bounds)
+        except WindowError:
+            continue  # part lies outside the raster
+        if win.width <= 0 or win.height <= 0:
+            continue
+        arr = src.read(1, window=win).astype("float32")
+        inside = features.geometry_mask(
+            [mapping(part)], out_shape=arr.shape,
+            transform=src.window_transform(win), invert=True,
+        )
+        if nodata is not None:
+            inside &= arr != nodata
+        inside &= np.isfinite(arr)
+        valid = arr[inside]
+        if valid.size == 0:
+            continue
+        total += float(valid.sum(dtype="float64"))
+        count += int(valid.size)
+        lo = min(lo, float(valid.min()))
+        hi = max(hi, float(valid.max()))
+
+    if count == 0:
+        return np.nan, np.nan, np.nan, 0
+    return total / count, lo, hi, count
+
+def _chunk_stats(src, chunk: list, nodata) -> list:
+    """Stats for a batch of (index, WKB) features against an open dataset."""
     log = get_logger("zonal")
+    results = []
+    for idx, geom_wkb in chunk:
+        try:
+            geom = wkb.loads(geom_wkb) if geom_wkb is not None else None
+            results.append(_feature_stats(src, geom, nodata))
+        except Exception as e:
+            log.warning(f"Polygon {idx} failed: {e}")
+            results.append((np.nan, np.nan, np.nan, 0))
+    return results
 
+def _windowed_chunk(raster_path: str, chunk: list, nodata) -> list:
+    """
+    Worker entry point: opens the raster once for its whole batch; only
+    WKB bytes cross the process boundary.
+    """
+    with rasterio.open(raster_path) as src:
+        return _chunk_stats(src, chunk, nodata)
+
+def _zonal_windowed(src, gdf: gpd.GeoDataFrame, nodata, log, n_jobs: int = -1):
+    """
+    Low-memory path for rasters too large to hold: per-polygon windowed
+    reads, accumulated as 1-D reductions, fanned out over processes.
+    """
+    items = [(idx, geom.wkb if geom is not None else None) for idx, geom in zip(gdf.index, gdf.geometry)]
+    workers = min(effective_n_jobs(n_jobs), len(items))
+    if workers <= 1:
+        results = _chunk_stats(src, items, nodata)
+    else:
+        # A few contiguous chunks per worker balances load without reopening per polygon
+        n_chunks = min(len(items), workers * 4)
+        size = -(-len(items) // n_chunks)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        log.info(f"Windowed zonal stats on {workers} workers ({len(chunks)} chunks)")
+        parts = Parallel(n_jobs=workers, backend="loky")(
+            delayed(_windowed_chunk)(src.name, chunk, nodata) for chunk in chunks
+        )
+        results = [r for part in parts for r in part]
+
+    means, mins, maxs, counts = (list(col) for col in zip(*results))
+    return means, mins, maxs, counts
+
+def _zonal_exactextract(raster_path: Path, gdf: gpd.GeoDataFrame, log):
+    """
+    Area-weighted stats for all polygons in one exactextract call
+    (C++ inner loop, partial-pixel coverage, one raster read per block).
+    """
+    from exactextract import exact_extract
+
+    df = exact_extract(str(raster_path), gdf, ["mean", "min", "max", "count"], output="pandas")
+    # 'count' is coverage-weighted; round it to whole pixels for ndvi_count
+    counts = df["count"].fillna(0).round().astype(int).to_numpy()
+    # Sub-pixel polygons round to 0: report NaN stats like the other methods
+    empty = counts == 0
+    if empty.any():
+        log.warning(f"{int(empty.sum())} polygon(s) cover no valid pixels")
+    means, mins, maxs = (np.where(empty, np.nan, df[c].to_numpy(dtype="float64")) for c in ("mean", "min", "max"))
+    return means, mins, maxs, counts
+
+def compute_zonal_mean(raster_path: Path, vector_path: Path, method: str = "rasterize",
+                       n_jobs: int = -1, index_cache_dir: Path | None = None) -> gpd.GeoDataFrame:
+    """
+    Per-field NDVI mean/min/max/count. Pass index_cache_dir to reuse the
+    rasterized field index across runs (off by default; the CLI enables it).
+    method='rasterize' switches to 'windowed' when fields overlap, so every
+    field counts its shared pixels.
+    """
+    log = get_logger("zonal")
+
+    if method not in ZONAL_METHODS:
+        raise ValueError(f"Unknown zonal method {method!r}; expected one of {ZONAL_METHODS}")
     if not Path(raster_path).exists():
         raise FileNotFoundError(f"Raster not found: {raster_path}")
     if not Path(vector_path).exists():
         raise FileNotFoundError(f"Vector not found: {vector_path}")
 
+    # Open the raster once for metadata and the reduction itself
     log.info(f"Loading raster: {raster_path}")
     with rasterio.open(raster_path) as src:
         raster_crs = src.crs
         nodata = src.nodata
+        # int16 NDVI is stored scaled (e.g. 0.0001); float rasters report 1.0
+        scale, offset = src.scales[0], src.offsets[0]
 
-    log.info(f"Loading polygons: {vector_path}")
-    gdf = gpd.read_file(vector_path)
-    if gdf.empty:
-        raise ValueError("Vector file has no features.")
-    if gdf.crs is None:
-        gdf.set_crs("EPSG:4326", inplace=True)
+        log.info(f"Loading polygons: {vector_path}")
+        gdf = gpd.read_file(vector_path, engine="pyogrio")
+        if gdf.empty:
+            raise ValueError("Vector file has no features.")
+        if gdf.crs is None:
+            gdf.set_crs("EPSG:4326", inplace=True)
 
-    # Reproject polygons to match raster CRS
-    gdf = gdf.to_crs(raster_crs)
-    log.info(f"Reprojected vector to raster CRS: {raster_crs}")
+        # Reproject polygons to match raster CRS
+        gdf = gdf.to_crs(raster_crs)
+        log.info(f"Reprojected vector to raster CRS: {raster_crs}")
 
-    # Compute NDVI statistics for each polygon
-    means, mins, maxs, counts = [], [], [], []
-    with rasterio.open(raster_path) as src:
-        for idx, row in gdf.iterrows():
-            geom = [mapping(row.geometry)]
-            try:
-                out_img, _ = mask(src, geom, crop=True)
-                arr = out_img[0].astype("float32")
-                if nodata is not None:
-                    arr[arr == nodata] = np.nan
-                valid = arr[np.isfinite(arr)]
-                if valid.size == 0:
-                    means.append(np.nan); mins.append(np.nan); maxs.append(np.nan); counts.append(0)
-                else:
-                    means.append(float(valid.mean()))
-                    mins.append(float(valid.min()))
-                    maxs.append(float(valid.max()))
-                    counts.append(int(valid.size))
-            except Exception as e:
-                log.warning(f"Polygon {idx} failed: {e}")
-                means.append(np.nan); mins.append(np.nan); maxs.append(np.nan); counts.append(0)
+        # Compute NDVI statistics for all polygons
+        if method == "rasterize" and _has_overlaps(gdf):
+            log.warning("Fields overlap; a label grid would give each shared pixel to one field only. "
+                        "Falling back to method=windowed")
+            method = "windowed"
+        log.info(f"Computing zonal stats with method={method}")
+        if method == "exactextract":
+            means, mins, maxs, counts = _zonal_exactextract(raster_path, gdf, log)
+            # exactextract reads through the band's scale/offset: already real NDVI
+            scale, offset = 1.0, 0.0
+        elif method == "windowed":
+            means, mins, maxs, counts = _zonal_windowed(src, gdf, nodata, log, n_jobs=n_jobs)
+        else:
+            means, mins, maxs, counts = _zonal_rasterize(src, gdf, log, index_cache_dir=index_cache_dir)
+
+    # rasterize/windowed reduce stored values; unscale to real NDVI (linear, so exact)
+    means, mins, maxs = (np.asarray(v, dtype="float64") * scale + offset for v in (means, mins, maxs))
 
     # Add statistics to GeoDataFrame
     gdf = gdf.copy()
@@ -75,23 +295,84 @@ def compute_zonal_mean(raster_path: Path, vector_path: Path) -> gpd.GeoDataFrame
     gdf["ndvi_count"] = counts
     return gdf
 
+def check_methods(raster_path: Path, vector_path: Path, tol: float = 0.05) -> dict:
+    """
+    Run every available zonal method on the same inputs and raise ValueError
+    if any disagrees with 'rasterize' on field means (median absolute
+    difference over fields valid in both; exactextract is area-weighted, so
+    small differences are expected). Catches scale/offset mistakes on int16
+    rasters. Returns {method: median abs diff}.
+    """
+    log = get_logger("zonal")
+    ref = compute_zonal_mean(raster_path, vector_path, method="rasterize")["ndvi_mean"].to_numpy(dtype="float64")
+    diffs = {}
+    for method in ZONAL_METHODS[1:]:
+        try:
+            other = compute_zonal_mean(raster_path, vector_path, method=method)["ndvi_mean"].to_numpy(dtype="float64")
+        except ImportError:
+            log.warning(f"Skipping method={method}: not installed")
+            continue
+        both = np.isfinite(ref) & np.isfinite(other)
+        diffs[method] = float(np.median(np.abs(ref[both] - other[both]))) if both.any() else 0.0
+        log.info(f"method={method} vs rasterize: median |Δ mean| = {diffs[method]:.5f}")
+    bad = {m: d for m, d in diffs.items() if d > tol}
+    if bad:
+        raise ValueError(f"Zonal methods disagree with rasterize (tol={tol}): {bad}")
+    return diffs
+
+def _csv_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Arrow table for the zonal CSV. Object, bool and datetime columns are
+    stringified the pandas way (nulls kept) so values read back as before and
+    mixed-type object columns don't raise ArrowTypeError. The text is not
+    byte-identical to to_csv: Arrow quotes the header and string values.
+    """
+    df = df.copy()
+    for col in df.columns:
+        s = df[col]
+        if (pd.api.types.is_object_dtype(s) or pd.api.types.is_bool_dtype(s)
+                or pd.api.types.is_datetime64_any_dtype(s)):
+            df[col] = s.astype(str).where(s.notna(), None)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--vector", default="data/vector/fields.geojson")
     ap.add_argument("--raster", default="data/processed/ndvi.tif")
     ap.add_argument("--out-geojson", default="data/processed/ndvi_zonal.geojson")
     ap.add_argument("--out-csv", default="data/processed/ndvi_zonal.csv")
+    ap.add_argument("--method", choices=ZONAL_METHODS, default="rasterize",
+                    help="'rasterize' uses one label grid (overlapping fields fall back to 'windowed'); "
+                         "'windowed' reads per-polygon windows (large rasters); "
+                         "'exactextract' gives area-weighted stats (needs the exactextract package)")
+    ap.add_argument("--jobs", type=int, default=-1,
+                    help="Worker processes for --method windowed (-1 = all cores)")
+    ap.add_argument("--index-cache-dir", default="data/processed",
+                    help="Where --method rasterize caches per-field pixel indices")
+    ap.add_argument("--no-index-cache", action="store_true", help="Always re-rasterize the fields")
+    ap.add_argument("--check-methods", action="store_true",
+                    help="Only verify that all zonal methods agree on these inputs; writes nothing")
     args = ap.parse_args()
 
+    if args.check_methods:
+        check_methods(Path(args.raster), Path(args.vector))
+        get_logger("zonal").info("✅ Zonal methods agree")
+        return
+
     out_geo = Path(args.out_geojson)
     out_geo.parent.mkdir(parents=True, exist_ok=True)
     out_csv = Path(args.out_csv)
 
-    gdf = compute_zonal_mean(Path(args.raster), Path(args.vector))
+    index_cache_dir = None if args.no_index_cache else Path(args.index_cache_dir)
+    gdf = compute_zonal_mean(Path(args.raster), Path(args.vector), method=args.method,
+                             n_jobs=args.jobs, index_cache_dir=index_cache_dir)
 
     # Save outputs
-    gdf.to_file(out_geo, driver="GeoJSON")
-    gdf.drop(columns="geometry").to_csv(out_csv, index=False)
+    gdf.to_file(out_geo, driver="GeoJSON", engine="pyogrio")
+    # Arrow's multithreaded C++ CSV writer instead of pandas' Python-level one
+    # (any RFC 4180 reader, incl. 06_postgis_ingest, parses its quoting)
+    pa_csv.write_csv(_csv_table(gdf.drop(columns="geometry")), out_csv,
+                     write_options=pa_csv.WriteOptions(quoting_style="needed"))
 
     log = get_logger("zonal")
     log.info(f"✅ Saved zonal GeoJSON: {out_geo}")
@@ -12,7 +12,8 @@ from __future__ import annotations
 from pathlib import Path
 import argparse
 import geopandas as gpd
-from shapely.geometry import Polygon
+import numpy as np
+import shapely
 import rasterio
 
 def make_grid_over_raster(raster_path: Path, rows: int, cols: int) -> gpd.GeoDataFrame:
@@ -24,18 +25,27 @@ def make_grid_over_raster(raster_path: Path, rows: int, cols: int) -> gpd.GeoDat
     dx = (maxx - minx) / cols
     dy = (maxy - miny) / rows
 
-    polys = []
-    fid = 1
-    for r in range(rows):
-        for c in range(cols):
-            x0 = minx + c*dx
-            y0 = miny + r*dy
-            x1 = x0 + dx
-            y1 = y0 + dy
-            polys.append({"id": fid, "name": f"Cell {fid}", "geometry": Polygon([(x0,y0),(x1,y0),(x1,y1),(x0,y1)])})
-            fid += 1
-
-    gdf = gpd.GeoDataFrame(polys, crs=crs)
+    # Build every cell at once (row-major, like the old nested loop) with
+    # Shapely 2's vectorized constructor instead of one Polygon per cell
+    c, r = np.meshgrid(np.arange(cols), np.arange(rows))
+    x0 = minx + c.ravel() * dx
+    y0 = miny + r.ravel() * dy
+    x1 = x0 + dx
+    y1 = y0 + dy
+    rings = np.stack([
+        np.column_stack([x0, y0]),
+        np.column_stack([x1, y0]),
+        np.column_stack([x1, y1]),
+        np.column_stack([x0, y1]),
+        np.column_stack([x0, y0]),
+    ], axis=1)  # (N, 5, 2)
+
+    fids = np.arange(1, rows * cols + 1)
+    gdf = gpd.GeoDataFrame(
+        {"id": fids, "name": [f"Cell {fid}" for fid in fids]},
+        geometry=shapely.polygons(rings),
+        crs=crs,
+    )
     # Save in EPSG:4326 for portability
     gdf = gdf.to_crs("EPSG:4326")
     return gdf
@@ -50,7 +60,7 @@ def main():
 
     out = Path(args.out); out.parent.mkdir(parents=True, exist_ok=True)
     gdf = make_grid_over_raster(Path(args.raster), args.rows, args.cols)
-    gdf.to_file(out, driver="GeoJSON")
+    gdf.to_file(out, driver="GeoJSON", engine="pyogrio")
     print(f"✅ Wrote {len(gdf)} grid polygons to {out}")
 
 if __name__ == "__main__":
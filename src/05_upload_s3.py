@@ -10,8 +10,9 @@ Usage:
 from __future__ import annotations
 from pathlib import Path
 import argparse, datetime
+from concurrent.futures import ThreadPoolExecutor
 from utils.log import get_logger
-from utils.aws_utils import upload_file
+from utils.aws_utils import TRANSFER_CONFIG, s3_client, upload_file
 
 def now_stamp():
     # ISO-ish timestamp for folder names, no colons (safe for S3)
@@ -39,11 +40,14 @@ def main():
     if args.sse:
         extra["ServerSideEncryption"] = args.sse
 
-    # Upload each file
-    uploaded = []
-    for local, key in files:
-        uri = upload_file(args.bucket, local, key, extra=extra)
-        uploaded.append(uri)
+    # Upload all files in parallel (boto3 clients are thread-safe; sessions aren't,
+    # so share one client). Every file runs up to max_concurrency part uploads,
+    # so give the client one pooled connection per thread
+    client = s3_client(max_pool_connections=len(files) * TRANSFER_CONFIG.max_concurrency)
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        uploaded = list(pool.map(
+            lambda f: upload_file(args.bucket, f[0], f[1], extra=extra, client=client), files
+        ))
 
     log.info("✅ Upload complete.")
     for uri in uploaded:
@@ -15,13 +15,14 @@ import os
 import argparse
 import uuid
 import pandas as pd
+from pyarrow import csv as pa_csv
 import sqlalchemy as sa
 
 from utils.log import get_logger
-from utils.db_utils import get_engine, init_schema
+from utils.db_utils import copy_dataframe, get_engine, init_schema
 
 # --- Windows/GeoPandas friendliness (safe no-ops on other OSes) ---
-os.environ.setdefault("GEOPANDAS_IO_ENGINE", "fiona")
+os.environ.setdefault("GEOPANDAS_IO_ENGINE", "pyogrio")
 # If you ever see PROJ/GDAL lookup warnings, also set these:
 os.environ.setdefault("PROJ_LIB", r"C:\Users\pchuk\mambaforge\envs\geofarm311\Library\share\proj")
 os.environ.setdefault("GDAL_DATA", r"C:\Users\pchuk\mambaforge\envs\geofarm311\Library\share\gdal")
@@ -33,11 +34,11 @@ def upsert_fields(engine: sa.Engine, fields_geojson: Path):
     Ensures CRS=EPSG:4326 and geometry column name = geom.
     """
     import geopandas as gpd
-    from geoalchemy2 import Geometry
+    import shapely
 
     log = get_logger("ingest")
 
-    gdf = gpd.read_file(fields_geojson)
+    gdf = gpd.read_file(fields_geojson, engine="pyogrio")
     if gdf.empty:
         log.warning("No features in fields.geojson")
         return
@@ -58,47 +59,44 @@ def upsert_fields(engine: sa.Engine, fields_geojson: Path):
     elif getattr(gdf.crs, "to_epsg", lambda: None)() != 4326:
         gdf = gdf.to_crs(4326)
 
-    # Match DB geometry column name
-    gdf = gdf.rename_geometry("geom")
+    # Geometry as hex EWKB (SRID embedded), which PostGIS parses straight from COPY text
+    rows = pd.DataFrame({
+        "field_id": gdf["field_id"].astype(str),
+        "name": gdf["name"],
+        "geom": shapely.to_wkb(shapely.set_srid(gdf.geometry.to_numpy(), 4326), hex=True, include_srid=True),
+    })
 
-    # Keep only columns your table has, in order
-    gdf = gdf[["field_id", "name", "geom"]].copy()
-
-    # Append to geofarm.fields (first time you may use if_exists="replace" to create it)
-    gdf.to_postgis(
-        name="fields",
-        con=engine,
-        schema="geofarm",                           # <- write to geofarm schema
-        if_exists="append",                         # <- change to "replace" ONLY on first create
-        index=False,
-        dtype={"geom": Geometry("MULTIPOLYGON", srid=4326)},
-    )
+    # Append to geofarm.fields (table is created by init_schema)
+    with engine.begin() as conn:
+        copy_dataframe(conn, "geofarm.fields", rows)
     log.info(f"Inserted/appended {len(gdf)} rows into geofarm.fields.")
 
 
-def create_run(engine: sa.Engine, acq_date: str | None, aoi_bbox: str | None, s3_prefix: str | None) -> str:
+def create_run(conn: sa.Connection, acq_date: str | None, aoi_bbox: str | None, s3_prefix: str | None) -> str:
     """
     Inserts one row into geofarm.ndvi_runs and returns run_id.
+    Runs in the caller's transaction so the run and its stats commit together.
     """
     run_id = str(uuid.uuid4())
-    with engine.begin() as conn:
-        conn.execute(
-            sa.text("""
-                INSERT INTO geofarm.ndvi_runs(run_id, acq_date, aoi_bbox, s3_prefix)
-                VALUES (:rid, :ad, :bbox, :pfx)
-            """),
-            {"rid": run_id, "ad": acq_date, "bbox": aoi_bbox, "pfx": s3_prefix},
-        )
+    conn.execute(
+        sa.text("""
+            INSERT INTO geofarm.ndvi_runs(run_id, acq_date, aoi_bbox, s3_prefix)
+            VALUES (:rid, :ad, :bbox, :pfx)
+        """),
+        {"rid": run_id, "ad": acq_date, "bbox": aoi_bbox, "pfx": s3_prefix},
+    )
     return run_id
 
 
-def load_zonal_csv(engine: sa.Engine, run_id: str, csv_path: Path):
+def load_zonal_csv(conn: sa.Connection, run_id: str, csv_path: Path):
     """
     Loads NDVI stats from CSV into geofarm.ndvi_stats (non-geometry table),
     aligning key column to 'field_id'.
     """
     log = get_logger("ingest")
-    df = pd.read_csv(csv_path)
+    # Multithreaded Arrow CSV reader; Arrow-backed dtypes keep ndvi_count an
+    # integer even when some values are null
+    df = pa_csv.read_csv(csv_path).to_pandas(types_mapper=pd.ArrowDtype)
 
     # Prefer 'field_id' if present, otherwise accept 'id'
     if "field_id" in df.columns:
@@ -118,9 +116,8 @@ def load_zonal_csv(engine: sa.Engine, run_id: str, csv_path: Path):
     ins_df = pd.DataFrame(cols)
     ins_df["run_id"] = run_id
 
-    # insert (pandas to_sql supports method="multi")
-    with engine.begin() as conn:
-        ins_df.to_sql("ndvi_stats", conn, schema="geofarm", if_exists="append", index=False, method="multi")
+    # bulk insert via COPY (far faster than multi-VALUES INSERTs)
+    copy_dataframe(conn, "geofarm.ndvi_stats", ins_df)
     log.info(f"Inserted {len(ins_df)} geofarm.ndvi_stats rows for run_id={run_id}")
 
 
@@ -161,11 +158,11 @@ init_schema(engine)  # should create geofarm schema + tables if missing
 if Path(args.fields).exists():
         upsert_fields(engine, Path(args.fields))
 
-    # 2) Create a run record
-run_id = create_run(engine, args.run_date, args.aoi, args.s3_prefix)
-
-    # 3) Insert stats
-load_zonal_csv(engine, run_id, Path(args.zonal))
+    # 2) + 3) Create a run record and insert its stats in ONE transaction, so
+    # readers (e.g. /ndvi/latest) never see a run without its rows
+with engine.begin() as conn:
+    run_id = create_run(conn, args.run_date, args.aoi, args.s3_prefix)
+    load_zonal_csv(conn, run_id, Path(args.zonal))
 
 log = get_logger("ingest")
 log.info(f"✅ Ingest completed. run_id={run_id}")
@@ -1,27 +1,54 @@
 from __future__ import annotations
 from pathlib import Path
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from utils.log import get_logger
 
 log = get_logger("aws")
 
-def s3_client():
-    # Uses default AWS CLI credentials/profile & region
-    return boto3.client("s3")
+# Multipart above 8 MB with parallel part uploads: large NDVI COGs use many
+# TCP streams instead of one
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True,
+)
 
-def upload_file(bucket: str, local_path: str | Path, key: str, extra: dict | None = None) -> str:
+# Set at upload time so objects never need a later metadata rewrite
+CONTENT_TYPES = {
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".geojson": "application/geo+json",
+    ".csv": "text/csv",
+}
+
+def s3_client(max_pool_connections: int | None = None):
+    # Uses default AWS CLI credentials/profile & region. Size the connection
+    # pool to the number of concurrent transfer threads sharing this client
+    # (botocore defaults to 10, and extra threads block waiting on the pool)
+    if max_pool_connections is None:
+        return boto3.client("s3")
+    return boto3.client("s3", config=Config(max_pool_connections=max_pool_connections))
+
+def upload_file(bucket: str, local_path: str | Path, key: str, extra: dict | None = None, client=None) -> str:
     """
-    Upload a single file to s3://bucket/key.
+    Upload a single file to s3://bucket/key (multipart for large files).
+    Pass a shared client when uploading from several threads.
     Returns the s3 uri if successful.
     """
-    client = s3_client()
+    client = client or s3_client()
     local_path = Path(local_path)
     if not local_path.exists():
         raise FileNotFoundError(local_path)
-    extra = extra or {}  # e.g., {"ServerSideEncryption": "AES256"}
+    extra = dict(extra or {})  # e.g., {"ServerSideEncryption": "AES256"}
+    content_type = CONTENT_TYPES.get(local_path.suffix.lower())
+    if content_type:
+        extra.setdefault("ContentType", content_type)
     try:
-        client.upload_file(str(local_path), bucket, key, ExtraArgs=extra)
+        client.upload_file(str(local_path), bucket, key, ExtraArgs=extra, Config=TRANSFER_CONFIG)
         log.info(f"Uploaded: {local_path} -> s3://{bucket}/{key}")
         return f"s3://{bucket}/{key}"
     except ClientError as e:
@@ -1,8 +1,14 @@
 from __future__ import annotations
+import io
+from typing import TYPE_CHECKING
 import sqlalchemy as sa
 from sqlalchemy.engine import Engine
 from utils.log import get_logger
 
+if TYPE_CHECKING:  # annotations only: the API image lacks pandas, the worker may lack greenlet
+    import pandas as pd
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
 log = get_logger("db")
 
 def get_engine(dsn: str) -> Engine:
@@ -16,6 +22,34 @@ def get_engine(dsn: str) -> Engine:
         log.error(f"DB connection failed: {e}")
         raise
 
+def get_async_engine(dsn: str, pool_size: int = 20) -> AsyncEngine:
+    """
+    asyncpg-backed engine for async handlers; any postgresql DSN
+    (e.g. postgresql+psycopg2://...) is switched to the asyncpg driver.
+    Imported lazily: sqlalchemy.ext.asyncio needs greenlet, which the sync
+    ingest step (06) shouldn't require.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = sa.engine.make_url(dsn).set(drivername="postgresql+asyncpg")
+    engine = create_async_engine(url, pool_pre_ping=True, pool_size=pool_size)
+    log.info("Created async Postgres engine (asyncpg).")
+    return engine
+
+def copy_dataframe(conn: sa.Connection, table: str, df: pd.DataFrame):
+    """
+    Bulk-load df into an existing table with COPY ... FROM STDIN (CSV).
+    Columns are matched by df's column names; NaN/None become NULL.
+    Much faster than multi-VALUES INSERTs beyond a few thousand rows.
+    Runs inside conn's transaction; the caller commits (e.g. engine.begin()).
+    """
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cols = ", ".join(df.columns)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+
 def init_schema(engine: Engine):
     ddl = """
     CREATE TABLE IF NOT EXISTS fields (
@@ -48,6 +82,11 @@ def init_schema(engine: Engine):
 
     CREATE INDEX IF NOT EXISTS idx_fields_geom ON fields USING GIST(geom);
     CREATE INDEX IF NOT EXISTS idx_stats_field ON ndvi_stats(field_id);
+    -- /ndvi/latest: index-only scan of one run's rows, already in field_id order
+    CREATE INDEX IF NOT EXISTS idx_stats_run_field ON ndvi_stats(run_id, field_id)
+        INCLUDE (ndvi_mean, ndvi_min, ndvi_max, ndvi_count);
+    -- /ndvi/runs and the latest-run lookup
+    CREATE INDEX IF NOT EXISTS idx_runs_created ON ndvi_runs(created_at DESC);
     """
     with engine.begin() as conn:
         conn.exec_driver_sql(ddl)
@@ -0,0 +1,15 @@
+from __future__ import annotations
+import math
+from rasterio.windows import Window, from_bounds
+
+def snapped_window(ds, bounds) -> Window:
+    """
+    Window covering bounds (in ds CRS), snapped outward to whole pixels and
+    clipped to the raster. Raises rasterio.errors.WindowError if the
+    bounds don't overlap the raster.
+    """
+    win = from_bounds(*bounds, transform=ds.transform)
+    col0, row0 = math.floor(win.col_off), math.floor(win.row_off)
+    col1 = math.ceil(win.col_off + win.width)
+    row1 = math.ceil(win.row_off + win.height)
+    return Window(col0, row0, col1 - col0, row1 - row0).intersection(Window(0, 0, ds.width, ds.height))
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import json
+import pickle
+from pathlib import Path
+from urllib.parse import urlparse
+import pystac
+import requests_cache
+from pystac_client import Client
+from pystac_client.stac_api_io import StacApiIO
+from utils.log import get_logger
+
+log = get_logger("stac")
+
+DISCOVER_JSON = Path("data/raw/discover.json")
+ITEMS_PKL = Path("data/raw/items.pkl")
+S2_COLLECTION = "sentinel-2-l2a"
+
+def open_catalog(stac_url: str, cache_path: str = ".cache/stac", expire_after: int = 3600) -> Client:
+    """
+    Open the STAC API with an on-disk (sqlite) response cache, so repeated
+    searches across pipeline steps don't re-page the catalog. The cache is
+    a session private to pystac-client and only covers the STAC API path:
+    SAS token requests (planetary_computer.sign) and asset downloads on
+    the same host never hit it.
+    """
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    url = urlparse(stac_url)
+    stac_pattern = f"{url.netloc}{url.path.rstrip('/')}"  # prefix match, e.g. host/api/stac/v1
+    session = requests_cache.CachedSession(
+        cache_path,
+        backend="sqlite",
+        expire_after=expire_after,
+        allowable_methods=("GET", "HEAD", "POST"),  # pystac-client searches via POST
+        urls_expire_after={stac_pattern: expire_after, "*": requests_cache.DO_NOT_CACHE},
+    )
+    stac_io = StacApiIO()
+    stac_io.session = session
+    return Client.open(stac_url, stac_io=stac_io)
+
+def save_items(items: list, path: str | Path = ITEMS_PKL):
+    """
+    Persist full search results (as STAC dicts) so later steps can reuse
+    them without searching again.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(pickle.dumps([it.to_dict() for it in items]))
+
+def load_cached_item(item_id: str, path: str | Path = ITEMS_PKL) -> pystac.Item | None:
+    """Return item_id from the items.pkl written by step 01, if present."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    for d in pickle.loads(path.read_bytes()):
+        if d.get("id") == item_id:
+            return pystac.Item.from_dict(d)
+    return None
+
+def load_discovered_item(item_id: str, path: str | Path = DISCOVER_JSON) -> dict | None:
+    """
+    Return the discover.json entry for item_id (written by step 01),
+    or None if the file is missing or the item isn't listed.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    for it in json.loads(path.read_text()).get("items", []):
+        if it.get("id") == item_id:
+            return it
+    return None
+
+def search_item(stac_url: str, item_id: str):
+    """
+    Look up a single item by id, letting the server filter instead of
+    paging the whole bbox/date search client-side.
+    """
+    catalog = open_catalog(stac_url)
+    items = list(catalog.search(ids=[item_id], collections=[S2_COLLECTION]).items())
+    return items[0] if items else None
+
+def resolve_item_hrefs(stac_url: str, item_id: str) -> tuple[str | None, dict] | None:
+    """
+    (datetime, {asset_key: href}) for item_id, trying in order: items.pkl,
+    discover.json, then a server-side STAC lookup. None if not found.
+    Hrefs are returned unsigned; sign them right before use since
+    signed URLs expire.
+    """
+    item = load_cached_item(item_id)
+    if item is not None:
+        log.info(f"Using cached item {item_id} from {ITEMS_PKL}")
+    else:
+        found = load_discovered_item(item_id)
+        if found and found.get("hrefs"):
+            log.info(f"Using cached item {item_id} from {DISCOVER_JSON}")
+            return found.get("datetime"), found["hrefs"]
+        item = search_item(stac_url, item_id)
+        if item is None:
+            return None
+    dt = item.datetime.isoformat() if item.datetime else None
+    return dt, {k: a.href for k, a in item.assets.items()}